@@ -1,16 +1,22 @@
 from typing import List, Dict, Tuple
 import hashlib
 import os
-import json
+import orjson
 import time
+from concurrent.futures import ThreadPoolExecutor
+from operator import itemgetter
 import numpy as np
 
 from annoy import AnnoyIndex
+import config
 from db.mongo_client import MongoDBHandler
 from models.bert_embedder import BERTEmbedder
 from models.dino_embedder import DINOv2Embedder
+from utils.devices import device_lock
 
-def seed_products(mongo: "MongoDBHandler", force_drop: bool = False) -> List:
+_REQUIRED_PRODUCT_KEYS = frozenset({"id", "name", "category", "price", "image_url"})
+
+def seed_products(mongo: "MongoDBHandler", force_drop: bool = False) -> int:
     """
     Seed the products collection with metadata from ../products.json.
 
@@ -20,45 +26,75 @@ def seed_products(mongo: "MongoDBHandler", force_drop: bool = False) -> List:
                            If False, only insert missing products.
 
     Returns:
-        List: Inserted product IDs (empty if nothing inserted).
+        int: Number of inserted products (0 if nothing inserted).
     """
     if force_drop:
         mongo.products.drop()
 
+    # Unique index on "id" so id lookups ($in / existing ids) avoid a COLLSCAN
+    mongo.products.create_index("id", unique=True)
+
     # Read metadata from products.json
     json_path = os.path.join(os.path.dirname(__file__), "../data/products.json")
     if not os.path.exists(json_path):
         raise FileNotFoundError(f"❌ products.json not found at {json_path}")
 
-    with open(json_path, "r", encoding="utf-8") as f:
-        products = json.load(f)
+    # Read all bytes up front and let orjson parse them in one pass
+    with open(json_path, "rb") as f:
+        raw = f.read()
+
+    # Skip parsing/validation/dedup entirely if this exact file was already seeded
+    digest = hashlib.blake2b(raw, digest_size=16).hexdigest()
+    seed_meta = mongo.db["_seed_meta"]
+    if not force_drop:
+        meta = seed_meta.find_one({"_id": "products"})
+        if (meta and meta.get("hash") == digest
+                and meta.get("count") == mongo.products.estimated_document_count()):
+            print("✅ products.json unchanged since last seed, skipping")
+            return 0
+
+    products = orjson.loads(raw)
 
     if not isinstance(products, list):
         raise ValueError("❌ products.json must contain a list of product dicts.")
 
-    # Validate minimal required keys
-    required_keys = {"id", "name", "category", "price", "image_url"}
+    # Validate minimal required keys (set difference only on the error path)
     for i, product in enumerate(products):
-        missing = required_keys - product.keys()
-        if missing:
-            raise ValueError(f"❌ Product at index {i} is missing required fields: {missing}")
-
-    # Get already existing product ids
-    existing_ids = set(
-        doc["id"] for doc in mongo.products.find({}, {"id": 1})
-    )
+        if not _REQUIRED_PRODUCT_KEYS.issubset(product):
+            missing = _REQUIRED_PRODUCT_KEYS - product.keys()
+            raise ValueError(f"❌ Product at index {i} is missing required fields: {set(missing)}")
+
+    # Get already existing product ids (only those overlapping the incoming file)
+    # An empty collection (e.g. right after force_drop) is answered from collection stats
+    existing_ids = set()
+    if mongo.products.estimated_document_count() > 0:
+        incoming_ids = [p["id"] for p in products]
+        existing_ids = {
+            doc["id"] for doc in mongo.products.find(
+                {"id": {"$in": incoming_ids}}, {"id": 1, "_id": 0}
+            ).hint("id_1")
+        }
 
     # Filter only new products
     new_products = [p for p in products if p["id"] not in existing_ids]
 
-    inserted_ids = []
+    inserted_count = 0
     if new_products:
-        result = mongo.products.insert_many(new_products)
-        inserted_ids = result.inserted_ids
+        # Unordered: the server may apply the batches without serializing on each insert
+        result = mongo.products.insert_many(
+            new_products, ordered=False, bypass_document_validation=True
+        )
+        inserted_count = len(result.inserted_ids)
+
+    seed_meta.update_one(
+        {"_id": "products"},
+        {"$set": {"hash": digest, "count": mongo.products.estimated_document_count()}},
+        upsert=True,
+    )
 
-    print(f"✅ Inserted {len(inserted_ids)} new products into MongoDB")
+    print(f"✅ Inserted {inserted_count} new products into MongoDB")
 
-    return inserted_ids
+    return inserted_count
 
 
 def seed_product_vectors_aligned(
@@ -68,12 +104,16 @@ def seed_product_vectors_aligned(
     alpha: float = 0.5,
     batch_size: int = 32,
     cache_dir: str = "data/cache",
-    cache_expiry_days: int = 30
+    cache_expiry_days: int = 30,
+    index_path: str = config.INDEX_PATH,
+    id_map_path: str = config.ID_MAP_PATH
 ) -> Tuple[AnnoyIndex, int, Dict[int, str]]:
     """
     Build an Annoy index by aligning BERT (text) and DINO (image) embeddings.
     Supports caching and batch embedding to speed up processing.
     Cache filename depends on sample_ids + expires after N days.
+    The index is built on disk and saved at `index_path`, with id_map and dim
+    written to `id_map_path`, so queries can mmap-load it via `load_index`.
     """
 
     os.makedirs(cache_dir, exist_ok=True)
@@ -81,30 +121,34 @@ def seed_product_vectors_aligned(
     # --------------------------
     # Fetch product metadata
     # --------------------------
-    docs_text = list(mongo.products.find(
-        {"id": {"$in": sample_ids}},
-        {"id": 1, "name": 1, "category": 1}
-    )) if sample_ids else list(mongo.products.find({}, {"id": 1, "name": 1, "category": 1}))
-    if not docs_text:
-        raise RuntimeError("❌ No products found for BERT embedding")
-
-    texts = [f"{d['name']} {d['category']}" for d in docs_text]
-    ids = [str(d["id"]) for d in docs_text]
-
-    docs_img = list(mongo.products.find(
-        {"id": {"$in": sample_ids}},
-        {"id": 1, "image_url": 1}
-    )) if sample_ids else list(mongo.products.find({}, {"id": 1, "image_url": 1}))
-    if not docs_img:
-        raise RuntimeError("❌ No products found for DINO embedding")
-
-    urls = [d["image_url"] for d in docs_img]
+    # One cursor for both modalities, streamed in batches (keeps ids/texts/urls aligned)
+    query = {"id": {"$in": sample_ids}} if sample_ids else {}
+    cursor = mongo.products.find(
+        query, {"id": 1, "name": 1, "category": 1, "image_url": 1}
+    ).batch_size(1000)
+
+    get_text_fields = itemgetter("name", "category")
+    texts, ids, urls = [], [], []
+    for d in cursor:
+        texts.append(" ".join(get_text_fields(d)))
+        ids.append(str(d["id"]))
+        urls.append(d["image_url"])
+
+    if not ids:
+        raise RuntimeError("❌ No products found for BERT/DINO embedding")
 
     # --------------------------
     # Generate cache key
     # --------------------------
-    key = ",".join(sorted(sample_ids)) if sample_ids else "all"
-    key_hash = hashlib.md5(key.encode()).hexdigest()[:8]
+    # Stream sorted ids into the digest instead of joining one large string
+    hasher = hashlib.blake2b(digest_size=4)
+    if sample_ids:
+        for sid in sorted(sample_ids):
+            hasher.update(sid.encode())
+            hasher.update(b"\0")
+    else:
+        hasher.update(b"all")
+    key_hash = hasher.hexdigest()
 
     text_cache = os.path.join(cache_dir, f"text_emb_{key_hash}.npy")
     img_cache = os.path.join(cache_dir, f"img_emb_{key_hash}.npy")
@@ -121,32 +165,50 @@ def seed_product_vectors_aligned(
     # --------------------------
     if is_cache_valid(text_cache) and is_cache_valid(img_cache):
         print(f"⚡ Loading embeddings from cache ({key_hash})...")
-        vecs_text = np.load(text_cache)
-        vecs_img = np.load(img_cache)
+        # Memory-mapped: pages are faulted in on demand while streaming into Annoy
+        vecs_text = np.load(text_cache, mmap_mode="r")
+        vecs_img = np.load(img_cache, mmap_mode="r")
     else:
         print(f"⚡ Rebuilding cache for {key_hash} (expired or missing)...")
 
-        # --- Encode text in batches ---
         bert = BERTEmbedder()
-        text_embs = []
-        for i in range(0, len(texts), batch_size):
-            batch = texts[i:i+batch_size]
-            vecs = bert.embed_texts(batch).cpu().numpy()
-            vecs /= np.linalg.norm(vecs, axis=1, keepdims=True)
-            text_embs.append(vecs)
-        vecs_text = np.vstack(text_embs)
+        dino = DINOv2Embedder(model_name="dinov2_vitb14")
+        dim_t = bert.model.config.hidden_size
+        dim_i = dino.model.embed_dim
+
+        # Aligned layout [text | image], filled in place batch by batch
+        combined_vecs = np.empty((len(texts), dim_t + dim_i), dtype=np.float32)
+
+        # Both embedders L2-normalize on device, so batches are copied as-is
+
+        # --- Encode text in batches ---
+        def encode_texts() -> None:
+            for i in range(0, len(texts), batch_size):
+                batch = texts[i:i+batch_size]
+                with device_lock(bert.device):
+                    combined_vecs[i:i+len(batch), :dim_t] = bert.embed_texts(batch).cpu().numpy()
 
         # --- Encode images in batches ---
-        dino = DINOv2Embedder(model_name="dinov2_vitb14")
-        img_embs = []
-        for i in range(0, len(urls), batch_size):
-            batch = urls[i:i+batch_size]
-            vecs = dino.embed_images(batch).cpu().numpy()
-            vecs /= np.linalg.norm(vecs, axis=1, keepdims=True)
-            img_embs.append(vecs)
-        vecs_img = np.vstack(img_embs)
-
-        # Save cache
+        def encode_images() -> None:
+            for i in range(0, len(urls), batch_size):
+                batch = urls[i:i+batch_size]
+                emb = dino.embed_images(batch)  # downloads outside the device lock
+                with device_lock(dino.device):
+                    combined_vecs[i:i+len(batch), dim_t:] = emb.cpu().numpy()
+
+        # Text (tokenizer + BERT) and images (download + DINO) use different
+        # resources, so run them side by side; each writes its own column half.
+        # On MPS the embedders' device work serializes on the shared device lock
+        with ThreadPoolExecutor(max_workers=2) as ex:
+            f_text = ex.submit(encode_texts)
+            f_img = ex.submit(encode_images)
+            f_text.result()
+            f_img.result()
+
+        vecs_text = combined_vecs[:, :dim_t]
+        vecs_img = combined_vecs[:, dim_t:]
+
+        # Save cache (float32, so mmap row stride matches on reload)
         np.save(text_cache, vecs_text)
         np.save(img_cache, vecs_img)
 
@@ -156,20 +218,69 @@ def seed_product_vectors_aligned(
     if vecs_text.shape[0] != vecs_img.shape[0]:
         raise RuntimeError("❌ Mismatch between text and image embeddings")
 
-    combined_vecs = np.concatenate([vecs_text, vecs_img], axis=1)
-    dim = combined_vecs.shape[1]
+    dim_t = vecs_text.shape[1]
+    dim = dim_t + vecs_img.shape[1]
 
     # --------------------------
     # Build Annoy index
     # --------------------------
+    # Build on disk (mmap) instead of the heap, then swap into place once built
+    tmp_index_path = index_path + ".tmp"
     index = AnnoyIndex(dim, "angular")
-    id_map: Dict[int, str] = {}
+    index.on_disk_build(tmp_index_path)
+    id_map: Dict[int, str] = dict(enumerate(ids))
+
+    # Stream rows through one reusable float32 buffer: no full N x dim
+    # concat and no per-row .tolist() Python float lists
+    row = np.empty(dim, dtype=np.float32)
+    add_item = index.add_item
+    for i in range(vecs_text.shape[0]):
+        row[:dim_t] = vecs_text[i]
+        row[dim_t:] = vecs_img[i]
+        add_item(i, row)
+
+    index.build(num_trees, n_jobs=-1)  # -1: build trees on all cores
+    os.replace(tmp_index_path, index_path)
+
+    # Persist metadata after the index, atomically (readers never see a partial file)
+    # id_map: maps Annoy index ID to product ID in MongoDB
+    # dim: embedding dimension, required to reload Annoy index
+    tmp_id_map_path = id_map_path + ".tmp"
+    with open(tmp_id_map_path, "wb") as f:
+        f.write(orjson.dumps({"id_map": {str(k): v for k, v in id_map.items()}, "dim": dim}))
+    os.replace(tmp_id_map_path, id_map_path)
 
-    for i, (vec, pid) in enumerate(zip(combined_vecs, ids)):
-        index.add_item(i, vec.tolist())
-        id_map[i] = pid
-
-    index.build(num_trees)
     print(f"✅ Built Annoy index (Aligned BERT+DINO) with {len(ids)} products (dim={dim}, cache={key_hash})")
 
+    return index, dim, id_map
+
+
+def load_index(
+    index_path: str = config.INDEX_PATH,
+    id_map_path: str = config.ID_MAP_PATH,
+    prefault: bool = False
+) -> Tuple[AnnoyIndex, int, Dict[int, str]]:
+    """
+    Load a persisted Annoy index (mmap, no rebuild) and its id_map.
+
+    Args:
+        index_path (str): Path of the saved Annoy index.
+        id_map_path (str): Path of the id_map/dim JSON written next to it.
+        prefault (bool): If True, fault the whole mmap into RAM up front.
+
+    Returns:
+        Tuple[AnnoyIndex, int, Dict[int, str]]: Index, embedding dimension, and id_map.
+    """
+    # id_map is written after the index, so an older id_map belongs to a previous build
+    if os.path.getmtime(id_map_path) < os.path.getmtime(index_path):
+        raise RuntimeError(f"❌ {id_map_path} is older than {index_path}, rebuild the index")
+
+    with open(id_map_path, "rb") as f:
+        data = orjson.loads(f.read())
+    id_map = {int(k): v for k, v in data["id_map"].items()}
+    dim = data["dim"]
+
+    index = AnnoyIndex(dim, "angular")
+    index.load(index_path, prefault=prefault)  # mmap: pages shared across processes
+
     return index, dim, id_map
\ No newline at end of file
@@ -24,6 +24,7 @@ class AnnoyVectorDB:
         self.metric = metric
         self.verbose = verbose
         self.dim: Optional[int] = None
+        self._get_nns = None
 
     def build_index(self, docs: List[Dict[str, Any]], embedder: BERTEmbedder) -> int:
         """
@@ -45,6 +46,7 @@ class AnnoyVectorDB:
 
         # Reset state
         self.index = None
+        self._get_nns = None
         self.id_map.clear()
 
         # Prepare texts
@@ -59,19 +61,23 @@ class AnnoyVectorDB:
         self.index = AnnoyIndex(self.dim, self.metric)
 
         # Add vectors
-        for i, v in enumerate(vecs):
-            self.index.add_item(i, v.tolist())
-            self.id_map[i] = ids[i]
+        self.id_map = dict(enumerate(ids))
+        add_item = self.index.add_item
+        for i in range(len(ids)):
+            add_item(i, vecs[i])
 
         # Build trees
         self.index.build(self.num_trees)
 
+        # Cache bound method to skip the attribute lookup per query
+        self._get_nns = self.index.get_nns_by_vector
+
         if self.verbose:
             print(f"[AnnoyVectorDB] Built index (dim={self.dim}, trees={self.num_trees})")
 
         return self.dim
 
-    def search(self, query_vec: np.ndarray, top_k: int = 5) -> List[Dict[str, Any]]:
+    def search(self, query_vec: np.ndarray, top_k: int = 5) -> Dict[str, Any]:
         """
         Search the Annoy index for nearest neighbors.
 
@@ -80,7 +86,8 @@ class AnnoyVectorDB:
             top_k (int): Number of nearest neighbors to return.
 
         Returns:
-            List[Dict[str, Any]]: Search results with mapped IDs and distances.
+            Dict[str, Any]: Column-oriented results, ordered by rank:
+                "ids" (List[str]), "distances" (np.ndarray[float32]), "ranks" (List[int]).
         """
         if self.index is None or self.dim is None:
             raise RuntimeError("Annoy index has not been built yet")
@@ -88,16 +95,12 @@ class AnnoyVectorDB:
         if query_vec.ndim == 2:  # [1, dim]
             query_vec = query_vec[0]
 
-        indices, distances = self.index.get_nns_by_vector(
-            query_vec.tolist(), top_k, include_distances=True
+        indices, distances = self._get_nns(
+            np.ascontiguousarray(query_vec, dtype=np.float32), top_k, include_distances=True
         )
 
-        results = []
-        for rank, (idx, dist) in enumerate(zip(indices, distances)):
-            results.append({
-                "rank": rank,
-                "id": self.id_map.get(idx),
-                "distance": float(dist)
-            })
-
-        return results
+        return {
+            "ids": [self.id_map.get(idx) for idx in indices],
+            "distances": np.asarray(distances, dtype=np.float32),
+            "ranks": list(range(len(indices))),
+        }
@@ -15,14 +15,13 @@ fi
 MODEL_PATH="$MODEL_ROOT/aligned/1/model.onnx"
 
 
-# Check if ONNX model exists
+# Export the ONNX model if missing or stale (the script exits early when
+# model.onnx matches the current models/versions/ONNX_* settings)
 if [ ! -f "$MODEL_PATH" ]; then
   echo "⚠️ Model not found at: $MODEL_PATH"
-  echo "→ Exporting ONNX model..."
-  PYTHONPATH="$BASE_PATH" python3 "$BASE_PATH/scripts/export_align_to_onnx.py"
-else
-  echo "✅ ONNX model already exists."
 fi
+echo "→ Checking ONNX export..."
+PYTHONPATH="$BASE_PATH" python3 "$BASE_PATH/scripts/export_align_to_onnx.py"
 
 
 # Continue to execute the original CMD
@@ -1,15 +1,16 @@
 import os
-import json
 import shutil, os, uuid
+import torch
 
 from fastapi import FastAPI, UploadFile, File, Form, Request
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse, JSONResponse, HTMLResponse
+from fastapi.responses import FileResponse, ORJSONResponse, HTMLResponse
+from starlette.concurrency import run_in_threadpool
 from starlette.exceptions import HTTPException as StarletteHTTPException
 
 import config
-from pipeline.apis import run_search
-from db.mongo_client import MongoDBHandler
+from pipeline.apis import run_search, get_embedder, get_index, load_product_meta
+from db.mongo_client import get_mongo
 from db.init_data import seed_products, seed_product_vectors_aligned
 from utils.logging_utils import with_logging
 
@@ -17,10 +18,12 @@ from utils.logging_utils import with_logging
 # Environment settings for stability (macOS M1/M2 + CPU)
 # -------------------------------------------------------------------
 os.environ["TOKENIZERS_PARALLELISM"] = "false"
-os.environ["OMP_NUM_THREADS"] = "1"
-os.environ["MKL_NUM_THREADS"] = "1"
 
-app = FastAPI()
+# Embedder mode: local models in dev mode, Triton otherwise
+EMBEDDER_TYPE = "local" if config.DEV_MODE else "triton"
+
+# orjson-backed responses: C-level JSON encoding for /search results
+app = FastAPI(default_response_class=ORJSONResponse)
 
 app.mount("/static", StaticFiles(directory="frontend", html=True), name="frontend")
 
@@ -50,41 +53,77 @@ async def custom_404_handler(request: Request, exc: StarletteHTTPException):
             return HTMLResponse("<h1>Oops! 🚀 Page not found</h1>", status_code=404)
     else:
         # Other errors keep default JSON
-        return JSONResponse(
+        return ORJSONResponse(
             {"detail": exc.detail},
             status_code=exc.status_code
         )
 
+# -------------------------------------------------------------------
+# Startup Event (torch threads)
+# -------------------------------------------------------------------
+@app.on_event("startup")
+def configure_torch_threads():
+    # Split cores across uvicorn workers (WEB_CONCURRENCY) instead of pinning
+    # BLAS to 1 thread: batched forwards benefit from intra-op parallelism.
+    # Registered first so it runs before any model is used.
+    workers = int(os.getenv("WEB_CONCURRENCY", "1"))
+    torch.set_num_threads(max(1, (os.cpu_count() or 1) // workers))
+    torch.set_num_interop_threads(1)
+
 # -------------------------------------------------------------------
 # Startup Event (seed DB + build index)
 # -------------------------------------------------------------------
 @app.on_event("startup")
 @with_logging("startup_seed_db")
 def seed_db():
-    # Initialize MongoDB connection using custom handler
-    mongo = MongoDBHandler()
+    # Shared MongoDB handler (one connection pool for the whole process)
+    mongo = get_mongo()
+    app.state.mongo = mongo
 
     # Seed products collection in MongoDB
-    # If force_drop=True, it will drop existing products and reload from products.json
-    seed_products(mongo, force_drop=True)
+    # force_drop=False keeps restarts idempotent: an unchanged products.json is
+    # skipped and otherwise only missing products are inserted
+    inserted = seed_products(mongo, force_drop=False)
+
+    # Keep product metadata in memory so /search doesn't hit MongoDB per query
+    app.state.product_meta = load_product_meta(mongo)
+
+    # Reuse the saved index instead of re-embedding every product, unless new products
+    # were inserted (they would be missing from it). get_index() warms the same
+    # mmap + prefault cache that run_search uses
+    if (not config.FORCE_REINDEX and inserted == 0 and os.path.exists(config.INDEX_PATH)
+            and os.path.exists(config.ID_MAP_PATH)):
+        try:
+            index, dim, id_map = get_index()
+            print(f"✅ Reusing existing index at {config.INDEX_PATH} ({len(id_map)} products, dim={dim})")
+            return
+        except RuntimeError as e:
+            print(f"⚠️ {e}")
+    elif inserted:
+        print(f"🌟 {inserted} new products inserted, rebuilding the index")
 
     # Fetch a list of product IDs (optionally sampled for testing/debugging)
     sample_ids = mongo.get_sample_ids(sample_size=config.SAMPLE_SIZE)
     print(f"🌟 Sample Size: {config.SAMPLE_SIZE}")
 
     # Build Annoy index by combining BERT (text) and DINO (image) embeddings
+    # Saves the index at config.INDEX_PATH and id_map + dim at config.ID_MAP_PATH
     # Returns: AnnoyIndex, embedding dimension, and id_map (Annoy internal ID -> product ID)
     index, dim, id_map = seed_product_vectors_aligned(mongo, sample_ids=sample_ids)
-
-    # Save index
-    # id_map: maps Annoy index ID to product ID in MongoDB
-    # dim: embedding dimension, required to reload Annoy index
-    index.save(config.INDEX_PATH)
-    with open(config.ID_MAP_PATH, "w", encoding="utf-8") as f:
-        json.dump({"id_map": id_map, "dim": dim}, f)
+    get_index()  # warm the search cache with the freshly built index
 
     print(f"✅ Seeding finished.\nIndex saved at {config.INDEX_PATH}\n✅ id_map and dim saved at {config.ID_MAP_PATH} (dim={dim})")
 
+def save_upload(src, filepath: str, chunk_size: int = 1 << 20):
+    """Write an uploaded file object to `filepath` in large chunks."""
+    with open(filepath, "wb") as buffer:
+        shutil.copyfileobj(src, buffer, chunk_size)
+
+@app.on_event("startup")
+def warm_embedder():
+    # Load the embedder once so requests don't pay for model/tokenizer loading
+    app.state.embedder = get_embedder(EMBEDDER_TYPE)
+
 @app.post("/search")
 @with_logging("search_request")
 async def search(
@@ -97,10 +136,6 @@ async def search(
     - If `image_url` is provided → use directly
     - At least one of them must exist
     """
-    # Decide embedder mode
-    dev_mode_env = config.DEV_MODE
-    embedder = "local" if dev_mode_env else "triton"
-
     final_url = None
     tmp_upload_dir = config.IMG_UPLOAD_DIR
     os.makedirs(tmp_upload_dir, exist_ok=True)
@@ -109,8 +144,8 @@ async def search(
     if file:
         filename = f"{uuid.uuid4().hex}_{file.filename}"
         filepath = os.path.join(tmp_upload_dir, filename)
-        with open(filepath, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
+        # Copy in the threadpool (1 MiB chunks) so large uploads don't block the event loop
+        await run_in_threadpool(save_upload, file.file, filepath)
         final_url = filepath
 
     # Handle URL
@@ -118,13 +153,16 @@ async def search(
         final_url = image_url
 
     else:
-        return JSONResponse({"error": "Please provide either an image file or image_url"}, status_code=400)
+        return ORJSONResponse({"error": "Please provide either an image file or image_url"}, status_code=400)
 
-    # Run your search pipeline
-    results = run_search(
+    # Run your search pipeline in the threadpool so the event loop stays free
+    # and concurrent requests can be batched together by the embedder
+    results = await run_in_threadpool(
+        run_search,
         query_text=query_text,
         query_image_url=final_url,
-        embedder_type=embedder
+        embedder_type=EMBEDDER_TYPE,
+        product_meta=app.state.product_meta
     )
 
     return results
\ No newline at end of file
@@ -1,9 +1,27 @@
 # models/aligned_embedder.py
 import torch
 import torch.nn as nn
-from transformers import BertModel, BertTokenizer, AutoModel, AutoImageProcessor
+import torch.nn.functional as F
+from torchvision import transforms as T
+from transformers import BertModel, BertTokenizerFast, AutoModel, AutoImageProcessor
 import config
 
+
+def build_image_transform(image_processor) -> T.Compose:
+    """
+    torchvision equivalent of the geometric part of the HF DINOv2 image processor
+    (resize shortest edge, center crop), producing uint8 [3, H, W] pixels.
+    Rescale + normalize run inside the exported graph (AlignedEmbedder.forward).
+    Runs as one torchvision pass instead of HF's per-image NumPy loop.
+    """
+    crop = image_processor.crop_size
+    return T.Compose([
+        T.Resize(image_processor.size["shortest_edge"], interpolation=T.InterpolationMode.BICUBIC),
+        T.CenterCrop((crop["height"], crop["width"])),
+        T.PILToTensor(),
+    ])
+
+
 class AlignedEmbedder(nn.Module):
     """
     AlignedEmbedder combines a text encoder (BERT) and a vision encoder (DINOv2)
@@ -16,10 +34,11 @@ class AlignedEmbedder(nn.Module):
     Input:
         input_ids: token IDs from BERT tokenizer [B, seq_len]
         attention_mask: attention mask for BERT [B, seq_len]
-        pixel_values: preprocessed image tensor [B, 3, H, W]
+        pixel_values: resized/cropped uint8 image tensor [B, 3, H, W]
 
     Output:
-        embedding: concatenated representation [B, 768 + 768]
+        embedding: concatenated representation [B, 768 + 768],
+                   each half L2-normalized (same layout as the Annoy index)
     """
 
     def __init__(self,
@@ -28,13 +47,21 @@ class AlignedEmbedder(nn.Module):
         super().__init__()
 
         # --- Text encoder (BERT) ---
-        self.bert = BertModel.from_pretrained(text_model_name)
-        self.tokenizer = BertTokenizer.from_pretrained(text_model_name)
+        # Only last_hidden_state[:, 0] is used: skip the pooler (dense + tanh) head
+        self.bert = BertModel.from_pretrained(text_model_name, add_pooling_layer=False)
+        self.tokenizer = BertTokenizerFast.from_pretrained(text_model_name)
 
         # --- Vision encoder (DINOv2) ---
         self.dino = AutoModel.from_pretrained(vision_model_name)
         self.image_processor = AutoImageProcessor.from_pretrained(vision_model_name)
 
+        # Processor's rescale + normalize folded into one multiply-subtract:
+        # (x * rescale - mean) / std == x * scale - shift
+        mean = torch.tensor(self.image_processor.image_mean).view(1, 3, 1, 1)
+        std = torch.tensor(self.image_processor.image_std).view(1, 3, 1, 1)
+        self.register_buffer("pixel_scale", self.image_processor.rescale_factor / std)
+        self.register_buffer("pixel_shift", mean / std)
+
     def forward(self, input_ids, attention_mask, pixel_values):
         """
         Forward pass through both encoders and align outputs.
@@ -42,10 +69,10 @@ class AlignedEmbedder(nn.Module):
         Args:
             input_ids (torch.Tensor): Token IDs for text input [B, seq_len].
             attention_mask (torch.Tensor): Attention mask [B, seq_len].
-            pixel_values (torch.Tensor): Preprocessed image tensor [B, 3, H, W].
+            pixel_values (torch.Tensor): Resized/cropped uint8 image tensor [B, 3, H, W].
 
         Returns:
-            torch.Tensor: Concatenated embedding [B, 1536].
+            torch.Tensor: Concatenated embedding [B, 1536], each half L2-normalized.
         """
 
         # --- Text embedding (CLS token from BERT) ---
@@ -53,10 +80,13 @@ class AlignedEmbedder(nn.Module):
         bert_cls = bert_out.last_hidden_state[:, 0, :]  # [B, 768]
 
         # --- Image embedding (CLS token from DINOv2) ---
+        pixel_values = pixel_values.float() * self.pixel_scale - self.pixel_shift
         dino_out = self.dino(pixel_values=pixel_values)
         dino_cls = getattr(dino_out, "pooler_output", None)
         if dino_cls is None:
             dino_cls = dino_out.last_hidden_state[:, 0, :]  # fallback [B, 768]
 
-        # --- Concatenate embeddings ---
+        # --- Normalize each half in-graph, then concatenate ---
+        bert_cls = F.normalize(bert_cls, p=2, dim=1)
+        dino_cls = F.normalize(dino_cls, p=2, dim=1)
         return torch.cat([bert_cls, dino_cls], dim=1)  # [B, 1536]
\ No newline at end of file
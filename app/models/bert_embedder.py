@@ -1,30 +1,78 @@
+from collections import OrderedDict
 from typing import List
+import threading
 import torch
-from transformers import BertTokenizer, BertModel
+from transformers import BertTokenizerFast, BertModel
 import config
+from utils.devices import device_lock
 
 class BERTEmbedder:
     """
     Wraps BERT (bert-base-uncased) to produce text embeddings.
     Returns L2-normalized tensors of shape [N, hidden_size].
+    Embeddings of recently seen texts are kept in a small LRU cache.
     """
 
-    def __init__(self, model_name: str = config.MODEL_BERT, device: str | None = None):
+    def __init__(self, model_name: str = config.MODEL_BERT, device: str | None = None,
+                 cache_size: int = 4096):
         # Select device: prefer MPS (Apple Silicon GPU), fallback to CPU
         self.device = device or ("mps" if torch.backends.mps.is_available() else "cpu")
 
-        # Load tokenizer and model
-        self.tokenizer = BertTokenizer.from_pretrained(model_name)
+        # Load tokenizer (Rust-backed fast tokenizer) and model
+        self.tokenizer = BertTokenizerFast.from_pretrained(model_name)
         self.model = BertModel.from_pretrained(model_name).to(self.device)
         self.model.eval()  # important: disable dropout etc. during inference
+        if self.device == "mps":
+            self.model.half()  # FP16 matmuls on MPS; input_ids/attention_mask stay int64
+
+        # Optional torch.compile (Inductor): fuses the encoder ops and the
+        # [CLS] slice + normalize. Inductor does not support MPS, so CPU only.
+        self._cls_normalize = _cls_normalize
+        if config.TORCH_COMPILE and self.device == "cpu":
+            self.model = torch.compile(self.model, dynamic=True)
+            self._cls_normalize = torch.compile(_cls_normalize, dynamic=True)
+            self._encode(["warmup"])  # compile now, not on the first request
+
+        # LRU cache: text -> embedding row on self.device (common queries like "jacket" repeat)
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[str, torch.Tensor]" = OrderedDict()
+        self._cache_lock = threading.Lock()
 
-    @torch.no_grad()
     def embed_texts(self, texts: List[str]) -> torch.Tensor:
         """
-        Encode texts into embeddings.
+        Encode texts into embeddings, skipping tokenization and the forward
+        pass for texts already in the cache.
+        Returns:
+            torch.Tensor: [N, hidden_size] tensor on self.device (L2 normalized).
+        """
+        # Cached rows live on self.device: clone/stack are device ops too
+        with device_lock(self.device):
+            with self._cache_lock:
+                rows = {t: self._cache[t] for t in texts if t in self._cache}
+                for t in rows:
+                    self._cache.move_to_end(t)
+
+            misses = list(dict.fromkeys(t for t in texts if t not in rows))
+            if misses:
+                embs = self._encode(misses)  # stays on device: callers concat there, copy to host once
+                with self._cache_lock:
+                    for t, emb in zip(misses, embs):
+                        emb = emb.clone()  # own storage, don't pin the whole batch in the cache
+                        rows[t] = emb
+                        self._cache[t] = emb
+                        self._cache.move_to_end(t)
+                    while len(self._cache) > self.cache_size:
+                        self._cache.popitem(last=False)
+
+            return torch.stack([rows[t] for t in texts])
+
+    @torch.inference_mode()
+    def _encode(self, texts: List[str]) -> torch.Tensor:
+        """
+        Run the model on texts.
         Strategy: use [CLS] token embedding (first token).
         Returns:
-            torch.Tensor: [N, hidden_size] tensor (L2 normalized).
+            torch.Tensor: [N, hidden_size] tensor on self.device (L2 normalized).
         """
         # Tokenize batch and move to device
         inputs = self.tokenizer(
@@ -37,8 +85,10 @@ class BERTEmbedder:
         # Forward pass
         outputs = self.model(**inputs)
 
-        # Use [CLS] embedding as sentence representation
-        cls_emb = outputs.last_hidden_state[:, 0, :]  # [batch, hidden_size]
+        # Use [CLS] embedding as sentence representation, normalized for cosine similarity
+        return self._cls_normalize(outputs.last_hidden_state)
+
 
-        # Normalize embeddings for cosine similarity
-        return torch.nn.functional.normalize(cls_emb, p=2, dim=1)
+def _cls_normalize(hidden: torch.Tensor) -> torch.Tensor:
+    """[CLS] token of each sequence ([batch, seq, hidden] -> [batch, hidden]), FP32 and L2-normalized."""
+    return torch.nn.functional.normalize(hidden[:, 0, :].float(), p=2, dim=1)
@@ -1,13 +1,21 @@
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Union, Optional
+import hashlib
 import io
+import os
+import threading
 import requests
+from requests.adapters import HTTPAdapter
 import torch
 import torch.nn.functional as F
 from PIL import Image
-from torchvision import transforms
-from torchvision.transforms import InterpolationMode
-import time
+from torchvision.transforms import InterpolationMode, v2
 import config
+from utils.devices import device_lock
+
+# Shared pool for image download/decode/preprocess (I/O-bound, PIL releases the GIL)
+_IO_WORKERS = 32
+_IO_POOL = ThreadPoolExecutor(max_workers=_IO_WORKERS)
 
 class DINOv2Embedder:
     """
@@ -27,6 +35,10 @@ class DINOv2Embedder:
         device: Optional[str] = None,
         image_size: int = 518,
         timeout: int = 10,
+        cache_dir: Optional[str] = config.IMG_CACHE_DIR,
+        cache_max_entries: int = config.IMG_CACHE_MAX_ENTRIES,
+        repo_dir: str = config.DINO_REPO_DIR,
+        weights_path: str = config.DINO_WEIGHTS,
     ):
         # Prefer MPS on Apple Silicon, else CPU
         if device is None:
@@ -34,18 +46,50 @@ class DINOv2Embedder:
         self.device = device
 
         # Load model from torch.hub (downloads on first run)
-        # Repo: facebookresearch/dinov2
-        self.model = torch.hub.load(
-            "facebookresearch/dinov2", model_name, trust_repo=True
-        ).to(self.device)
+        # Repo: facebookresearch/dinov2, or a pinned local checkout of it (no code download).
+        # Weights come from the hub URL unless a local checkpoint is given: only both skip the network
+        if repo_dir:
+            model = torch.hub.load(repo_dir, model_name, source="local", pretrained=not weights_path)
+        else:
+            model = torch.hub.load(
+                "facebookresearch/dinov2", model_name, trust_repo=True, pretrained=not weights_path
+            )
+        if weights_path:
+            # mmap + assign: the model adopts the checkpoint's tensors, paged in on first use,
+            # instead of copying them into freshly allocated parameters
+            state_dict = torch.load(weights_path, map_location="cpu", mmap=True, weights_only=True)
+            model.load_state_dict(state_dict, strict=True, assign=True)
+        self.model = model.to(self.device)
         self.model.eval()
 
+        # Half precision on accelerators halves bytes per matmul: BF16 on CUDA
+        # (tensor cores, no overflow), FP16 on MPS; CPU stays FP32
+        self.device_type = torch.device(self.device).type
+        self.dtype = {"cuda": torch.bfloat16, "mps": torch.float16}.get(self.device_type, torch.float32)
+        self.model.to(self.dtype)
+        self.model.to(memory_format=torch.channels_last)
+
+        # Optional torch.compile of the ViT body only (static shapes, CUDA graphs on GPU).
+        # Hub DINOv2 forward() returns the normalized CLS token. MPS has compile gaps.
+        self._compiled_forward = None
+        if config.TORCH_COMPILE and self.device_type in ("cuda", "cpu"):
+            self._compiled_forward = torch.compile(
+                self.model, mode="reduce-overhead", fullgraph=True, dynamic=False
+            )
+            warmup = torch.zeros(1, 3, image_size, image_size, device=self.device, dtype=self.dtype)
+            self._forward_to_embedding(warmup.contiguous(memory_format=torch.channels_last))
+
         # Preprocessing (DINOv2 uses ImageNet mean/std, 518x518 center crop by default)
-        self.preprocess = transforms.Compose([
-            transforms.Resize(image_size, interpolation=InterpolationMode.BICUBIC),
-            transforms.CenterCrop(image_size),
-            transforms.ToTensor(),
-            transforms.Normalize(
+        # Per image on CPU: resize + crop, kept as uint8 (4x fewer bytes to the device)
+        self.preprocess = v2.Compose([
+            v2.Resize(image_size, interpolation=InterpolationMode.BICUBIC, antialias=True),
+            v2.CenterCrop(image_size),
+            v2.PILToTensor(),
+        ])
+        # Per batch on the device: scale to [0, 1] + normalize in one pass
+        self.normalize = v2.Compose([
+            v2.ToDtype(torch.float32, scale=True),
+            v2.Normalize(
                 mean=(0.485, 0.456, 0.406),
                 std=(0.229, 0.224, 0.225),
             ),
@@ -53,7 +97,23 @@ class DINOv2Embedder:
 
         self.timeout = timeout
 
-    @torch.no_grad()
+        # Keep-alive HTTP session + on-disk cache of downloaded image bytes
+        # (repeat URLs skip the HTTP round-trip and TLS handshake entirely)
+        # Pool sized to _IO_POOL so parallel downloads reuse connections
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=_IO_WORKERS, pool_maxsize=_IO_WORKERS)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.cache_dir = cache_dir
+        self.cache_max_entries = cache_max_entries
+        self._evict_lock = threading.Lock()
+        self._cache_entries = 0
+        if self.cache_dir:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            # Count once at startup; writes keep it current so only overflow rescans the dir
+            self._cache_entries = len(self._scan_cache())
+
+    @torch.inference_mode()
     def embed_images(self, images: List[Union[str, Image.Image]]) -> torch.Tensor:
         """
         Encode a batch of images into global DINOv2 embeddings (L2-normalized).
@@ -62,37 +122,131 @@ class DINOv2Embedder:
         Returns:
             Tensor of shape [N, D]
         """
-        pil_batch = [self._to_pil(img) for img in images]
-        pixel_batch = torch.stack([self.preprocess(im) for im in pil_batch]).to(self.device)
-        # print(pixel_batch)
+        # Fetch + decode + preprocess concurrently: N URLs cost ~1 RTT instead of N
+        pixels = list(_IO_POOL.map(self._load_pixels, images))
+        # Stage the uint8 batch in pinned memory on CUDA so the H2D copy is an async DMA
+        staging = torch.empty((len(pixels), *pixels[0].shape), dtype=torch.uint8,
+                              pin_memory=self.device_type == "cuda")
+        torch.stack(pixels, out=staging)
+        # Device work under the MPS lock (no-op on CPU/CUDA); downloads above stay concurrent
+        with device_lock(self.device):
+            pixel_batch = staging.to(self.device, non_blocking=True)  # uint8 [N, 3, H, W]
+            pixel_batch = self.normalize(pixel_batch).to(self.dtype)
+            pixel_batch = pixel_batch.contiguous(memory_format=torch.channels_last)
+            # print(pixel_batch)
 
-        # Prefer using forward_features if available to get CLS token explicitly
-        feats = self._forward_to_embedding(pixel_batch)
-        feats = F.normalize(feats, p=2, dim=1)
-        return feats
+            # Compiled graph is static: pad to a power-of-two batch so only a few shapes compile
+            n = pixel_batch.shape[0]
+            if self._compiled_forward is not None:
+                padded = 1 << (n - 1).bit_length()
+                if padded > n:
+                    pad = pixel_batch.new_zeros((padded - n, *pixel_batch.shape[1:]))
+                    pixel_batch = torch.cat([pixel_batch, pad]).contiguous(memory_format=torch.channels_last)
+
+            # Prefer using forward_features if available to get CLS token explicitly
+            # Back to FP32 before normalizing (small-norm precision) and for Annoy
+            feats = self._forward_to_embedding(pixel_batch)[:n].float()
+            feats = F.normalize(feats, p=2, dim=1)
+            return feats
 
     # -------------------------------
     # Internals
     # -------------------------------
-    def _to_pil(self, x: Union[str, Image.Image]) -> Image.Image:
+    def _load_pixels(self, x: Union[str, Image.Image]) -> torch.Tensor:
+        return self.preprocess(self._decode_pil(x))
+
+    def _decode_pil(self, x: Union[str, Image.Image]) -> Image.Image:
         if isinstance(x, Image.Image):
             return x.convert("RGB")
         if isinstance(x, str):
             if x.startswith("http://") or x.startswith("https://"):
-                resp = requests.get(x, timeout=self.timeout)
-                time.sleep(1)
-                resp.raise_for_status()
-                return Image.open(io.BytesIO(resp.content)).convert("RGB")
+                return Image.open(io.BytesIO(self._fetch_bytes(x))).convert("RGB")
             return Image.open(x).convert("RGB")
         raise TypeError(f"Unsupported image input type: {type(x)}")
 
-    @torch.no_grad()
+    def _fetch_bytes(self, url: str) -> bytes:
+        """Download image bytes, going through the on-disk cache if enabled."""
+        cache_path = None
+        if self.cache_dir:
+            key = hashlib.blake2b(url.encode(), digest_size=16).hexdigest()
+            cache_path = os.path.join(self.cache_dir, key)
+            try:
+                with open(cache_path, "rb") as f:
+                    data = f.read()
+            except FileNotFoundError:
+                pass  # miss, or evicted concurrently
+            else:
+                try:
+                    os.utime(cache_path)  # LRU: mtime = last use (atime is often noatime)
+                except OSError:
+                    pass  # evicted since the read: the bytes are still good
+                return data
+
+        resp = self.session.get(url, timeout=self.timeout)
+        resp.raise_for_status()
+
+        if cache_path:
+            # Write-then-rename so concurrent readers never see a partial file
+            tmp_path = f"{cache_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(resp.content)
+            os.replace(tmp_path, cache_path)
+            with self._evict_lock:
+                self._cache_entries += 1
+                if self._cache_entries > self.cache_max_entries:
+                    self._evict_cache()
+        return resp.content
+
+    def _scan_cache(self) -> list:
+        """(mtime, path) of every finished cache entry."""
+        entries = []
+        with os.scandir(self.cache_dir) as it:
+            for e in it:
+                if e.is_file() and not e.name.endswith(".tmp"):
+                    try:
+                        entries.append((e.stat().st_mtime, e.path))
+                    except FileNotFoundError:
+                        continue
+        return entries
+
+    def _evict_cache(self) -> None:
+        """
+        Drop least recently used entries (oldest mtime) down to 90% of cache_max_entries,
+        so the next scan is a few hundred writes away. Caller holds _evict_lock.
+        """
+        entries = self._scan_cache()
+        low_water = self.cache_max_entries * 9 // 10
+        excess = len(entries) - low_water
+        if excess > 0:
+            entries.sort()
+            for _, path in entries[:excess]:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+        # Recount from the scan: concurrent rewrites of one URL over-count in between
+        self._cache_entries = min(len(entries), low_water)
+
+    @torch.inference_mode()
     def _forward_to_embedding(self, pixel_batch: torch.Tensor) -> torch.Tensor:
         """
         Get the CLS/global embedding. DINOv2 torch.hub models expose `forward_features`
         that returns a dict with keys like 'x_norm_clstoken'. If not present,
         fallback to plain forward() output.
         """
+        # Autocast (CUDA only) keeps any op the weights' dtype misses in BF16 too.
+        # torch 2.2 has no MPS autocast (the constructor raises); MPS weights are already FP16
+        if self.device_type != "cuda":
+            return self._run_forward(pixel_batch)
+        with torch.autocast(device_type="cuda", dtype=self.dtype):
+            return self._run_forward(pixel_batch)
+
+    def _run_forward(self, pixel_batch: torch.Tensor) -> torch.Tensor:
+        if self._compiled_forward is not None:
+            return self._compiled_forward(pixel_batch)
+        return self._forward_features(pixel_batch)
+
+    def _forward_features(self, pixel_batch: torch.Tensor) -> torch.Tensor:
         # Some hub models: dict with 'x_norm_clstoken'
         if hasattr(self.model, "forward_features"):
             out = self.model.forward_features(pixel_batch)
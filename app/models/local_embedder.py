@@ -1,8 +1,12 @@
+from concurrent.futures import Future, wait
 from typing import List, Optional
 import numpy as np
+import torch
 from models.base_embedder import BaseEmbedder
 from models.bert_embedder import BERTEmbedder
 from models.dino_embedder import DINOv2Embedder
+from utils.batching import DynamicBatcher
+from utils.devices import device_lock
 
 class LocalEmbedder(BaseEmbedder):
     """
@@ -14,6 +18,7 @@ class LocalEmbedder(BaseEmbedder):
         2. Image only
         3. Text + Image
     If one modality is missing, a zero vector is used to keep dimensions consistent.
+    Concurrent calls are coalesced into shared BERT/DINO forward passes.
     """
 
     def __init__(self):
@@ -24,6 +29,20 @@ class LocalEmbedder(BaseEmbedder):
         self.image_dim = 768
         self.total_dim = self.text_dim + self.image_dim
 
+        # Cached zero rows for a missing modality, on the device of the half that is present
+        # (expanded per call: a view, no allocation or zero-fill per query)
+        self._text_zero = torch.zeros((1, self.text_dim), dtype=torch.float32, device=self.dino.device)
+        self._img_zero = torch.zeros((1, self.image_dim), dtype=torch.float32, device=self.bert.device)
+
+        # Dynamic batching: concurrent requests share one forward pass per model
+        self._text_batcher = DynamicBatcher(self.bert.embed_texts, max_batch_size=32, timeout_ms=10)
+        self._image_batcher = DynamicBatcher(self.dino.embed_images, max_batch_size=32, timeout_ms=10)
+
+    @staticmethod
+    def _gather(futures: List[Future]) -> torch.Tensor:
+        """Wait for per-item batcher futures and stack their rows as [N, dim]."""
+        return torch.stack([f.result() for f in futures])
+
     def embed(self, texts: Optional[List[str]] = None,
                     images: Optional[List[str]] = None) -> np.ndarray:
         """
@@ -36,30 +55,33 @@ class LocalEmbedder(BaseEmbedder):
         Returns:
             np.ndarray: Concatenated embeddings [N, total_dim].
         """
-        batch_size = 0
-        parts = []
-
-        # --- Encode text (if provided) ---
-        if texts:
-            text_emb = self.bert.embed_texts(texts).cpu().numpy()
-            text_emb /= np.linalg.norm(text_emb, axis=1, keepdims=True)
-            batch_size = text_emb.shape[0]
-        else:
-            text_emb = None
+        # --- Encode text / images (if provided) ---
+        # Submit both modalities before waiting: BERT and DINO run concurrently
+        # on their own batcher threads (the forward passes release the GIL).
+        # On MPS the forwards serialize on the device lock; image downloads still overlap
+        text_futures = [self._text_batcher.submit(t) for t in texts] if texts else None
+        img_futures = [self._image_batcher.submit(i) for i in images] if images else None
+        if not text_futures and not img_futures:
+            return np.empty((0, self.total_dim), dtype=np.float32)
 
-        # --- Encode images (if provided) ---
-        if images:
-            img_emb = self.dino.embed_images(images).cpu().numpy()
-            img_emb /= np.linalg.norm(img_emb, axis=1, keepdims=True)
-            batch_size = img_emb.shape[0]
-        else:
-            img_emb = None
+        # Wait before taking the device lock: the batcher threads need it for their forwards
+        wait((text_futures or []) + (img_futures or []))
 
-        # --- Handle missing modality (pad with zeros) ---
-        if text_emb is None:
-            text_emb = np.zeros((batch_size, self.text_dim), dtype=np.float32)
-        if img_emb is None:
-            img_emb = np.zeros((batch_size, self.image_dim), dtype=np.float32)
+        # Stack/concat/copy run on the encoders' device: under the MPS lock, since the
+        # batcher threads' forwards may be using the MPS command stream concurrently
+        device = self.dino.device if img_futures else self.bert.device
+        with device_lock(device):
+            text_emb = self._gather(text_futures) if text_futures else None
+            img_emb = self._gather(img_futures) if img_futures else None
 
-        # --- Concatenate embeddings ---
-        return np.concatenate([text_emb, img_emb], axis=1)  # [N, 1536]
+            # Both encoders already return L2-normalized halves on their device: no second
+            # normalization, concat there and copy to host once
+            ref = img_emb if img_emb is not None else text_emb
+            batch_size, device = ref.shape[0], ref.device
+            parts = [
+                emb.to(device) if emb is not None
+                # missing modality: zero half keeps dimensions consistent
+                else zero.to(device).expand(batch_size, -1)
+                for emb, zero in ((text_emb, self._text_zero), (img_emb, self._img_zero))
+            ]
+            return torch.cat(parts, dim=1).cpu().numpy()
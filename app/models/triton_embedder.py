@@ -1,9 +1,25 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+import io
 import os
+import threading
+from urllib.parse import urlparse
 import numpy as np
 import requests
-from transformers import BertTokenizer, AutoImageProcessor
+from requests.adapters import HTTPAdapter
+import tritonclient.http as httpclient
+from transformers import BertTokenizerFast, AutoImageProcessor
 from PIL import Image
 import config
+from models.aligned_embedder import build_image_transform
+
+# Shared pool for query image download/decode/preprocess (sized to the HTTP pool)
+_IO_WORKERS = 16
+_IO_POOL = ThreadPoolExecutor(max_workers=_IO_WORKERS)
+
+# Request shapes: static sequence length of the exported graph, Triton max_batch_size
+_SEQ_LEN = 16
+_MAX_BATCH_SIZE = 32
 
 class TritonEmbedder:
     """
@@ -11,24 +27,52 @@ class TritonEmbedder:
     and receive aligned embeddings from the deployed ONNX model.
     """
 
-    def __init__(self, url: str = config.TRITON_URL, model_name: str = config.TRITON_MODEL_NAME):
+    def __init__(self, url: str = config.TRITON_URL, model_name: str = config.TRITON_MODEL_NAME,
+                 timeout: int = 10):
         self.url = url.rstrip("/")
         self.model_name = model_name
-        self.infer_url = f"{self.url}/v2/models/{self.model_name}/infer"
+        # tritonclient takes host:port; the scheme only decides TLS
+        parsed = urlparse(self.url)
+        self._host = parsed.netloc or parsed.path
+        self._ssl = parsed.scheme == "https"
+        # tritonclient HTTP clients are not thread-safe: one per search thread
+        self._local = threading.local()
+
+        # Keep-alive session for query image downloads (no TCP/TLS handshake per query)
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=_IO_WORKERS, pool_maxsize=_IO_WORKERS, max_retries=3)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
 
         # Local preprocessing tools
-        self.tokenizer = BertTokenizer.from_pretrained(config.MODEL_BERT)
-        self.image_processor = AutoImageProcessor.from_pretrained(config.TRIOTON_MODEL_DINO)
+        self.tokenizer = BertTokenizerFast.from_pretrained(config.MODEL_BERT)  # Rust-backed
+        self.image_processor = AutoImageProcessor.from_pretrained(config.TRITON_MODEL_DINO)
+        self.image_transform = build_image_transform(self.image_processor)
+
+    @property
+    def client(self) -> httpclient.InferenceServerClient:
+        """This thread's Triton HTTP client (created on first use)."""
+        client = getattr(self._local, "client", None)
+        if client is None:
+            client = httpclient.InferenceServerClient(url=self._host, ssl=self._ssl)
+            self._local.client = client
+        return client
 
     def _load_image(self, path_or_url: str) -> Image.Image:
         """Support both local file path and HTTP URL"""
         if path_or_url.startswith("http://") or path_or_url.startswith("https://"):
-            return Image.open(requests.get(path_or_url, stream=True).raw).convert("RGB")
+            resp = self.session.get(path_or_url, timeout=self.timeout)
+            resp.raise_for_status()
+            return Image.open(io.BytesIO(resp.content)).convert("RGB")
         elif os.path.exists(path_or_url):
             return Image.open(path_or_url).convert("RGB")
         else:
             raise ValueError(f"❌ Invalid image path or URL: {path_or_url}")
 
+    def _load_pixels(self, path_or_url: str) -> np.ndarray:
+        return self.image_transform(self._load_image(path_or_url)).numpy()  # [3, 224, 224] uint8
+
     def embed(self, text: str, image_path_or_url: str) -> np.ndarray:
         """
         Generate aligned embedding by sending inputs to Triton.
@@ -40,49 +84,63 @@ class TritonEmbedder:
         Returns:
             np.ndarray: A 2D numpy array of shape [1, embedding_dim].
         """
+        return self.embed_batch([text], [image_path_or_url])
+
+    def embed_batch(self, texts: List[str], image_paths_or_urls: List[str]) -> np.ndarray:
+        """
+        Generate aligned embeddings for B (text, image) pairs, one Triton request
+        per chunk of at most max_batch_size (32) pairs.
+
+        Args:
+            texts (List[str]): B input text strings for BERT.
+            image_paths_or_urls (List[str]): B local paths or HTTP URLs for DINOv2.
+
+        Returns:
+            np.ndarray: A 2D numpy array of shape [B, embedding_dim].
+        """
+        if len(texts) != len(image_paths_or_urls):
+            raise ValueError("❌ texts and image_paths_or_urls must have the same length")
+
+        # Triton rejects requests with more rows than the model's max_batch_size
+        chunks = [
+            self._embed_chunk(texts[i:i + _MAX_BATCH_SIZE], image_paths_or_urls[i:i + _MAX_BATCH_SIZE])
+            for i in range(0, len(texts), _MAX_BATCH_SIZE)
+        ]
+        if len(chunks) == 1:
+            return chunks[0]
+        return np.concatenate(chunks, axis=0)
+
+    def _embed_chunk(self, texts: List[str], image_paths_or_urls: List[str]) -> np.ndarray:
+        """One Triton request for at most _MAX_BATCH_SIZE (text, image) pairs."""
+        # --- Preprocess images concurrently (download dominates) ---
+        pixel_futures = [_IO_POOL.submit(self._load_pixels, x) for x in image_paths_or_urls]
 
-        # --- Preprocess text ---
+        # --- Preprocess text (one batched tokenizer call) while images load ---
         tokens = self.tokenizer(
-            text,
+            texts,
             return_tensors="np",
             padding="max_length",
             truncation=True,
-            max_length=16
+            max_length=_SEQ_LEN
         )
-        input_ids = tokens["input_ids"].astype("int64")
-        attention_mask = tokens["attention_mask"].astype("int64")
-
-        # --- Preprocess image ---
-        image = self._load_image(image_path_or_url)
-        pixel_values = self.image_processor(images=image, return_tensors="np")["pixel_values"].astype("float32")
-
-        # --- Triton payload ---
-        payload = {
-            "inputs": [
-                {
-                    "name": "input_ids",
-                    "shape": list(input_ids.shape),
-                    "datatype": "INT64",
-                    "data": input_ids.flatten().tolist()
-                },
-                {
-                    "name": "attention_mask",
-                    "shape": list(attention_mask.shape),
-                    "datatype": "INT64",
-                    "data": attention_mask.flatten().tolist()
-                },
-                {
-                    "name": "pixel_values",
-                    "shape": list(pixel_values.shape),
-                    "datatype": "FP32",
-                    "data": pixel_values.flatten().tolist()
-                }
-            ],
-            "outputs": [{"name": "embedding"}]
-        }
-
-        resp = requests.post(self.infer_url, json=payload)
-        resp.raise_for_status()
-        result = resp.json()["outputs"][0]["data"]
-
-        return np.array(result).reshape(1, -1)
\ No newline at end of file
+
+        # Tokenizer output is already int64: no copy
+        input_ids = tokens["input_ids"].astype(np.int64, copy=False)
+        attention_mask = tokens["attention_mask"].astype(np.int64, copy=False)
+        pixel_values = np.stack([f.result() for f in pixel_futures])  # [B, 3, 224, 224] uint8
+
+        # --- Triton request: raw tensor bytes (binary extension), no JSON number lists ---
+        inputs = []
+        for name, array, datatype in (
+            ("input_ids", input_ids, "INT64"),
+            ("attention_mask", attention_mask, "INT64"),
+            ("pixel_values", pixel_values, "UINT8"),  # normalized in-graph: 4x fewer bytes
+        ):
+            infer_input = httpclient.InferInput(name, list(array.shape), datatype)
+            infer_input.set_data_from_numpy(array, binary_data=True)
+            inputs.append(infer_input)
+        outputs = [httpclient.InferRequestedOutput("embedding", binary_data=True)]
+
+        result = self.client.infer(self.model_name, inputs, outputs=outputs)
+
+        return result.as_numpy("embedding").reshape(len(texts), -1)
@@ -1,81 +1,111 @@
-import sys
-import json
+from functools import lru_cache
+from typing import Dict, Optional
+import os
+import numpy as np
 import config
 
-from annoy import AnnoyIndex
-from db.mongo_client import MongoDBHandler
+from db.init_data import load_index
+from db.mongo_client import MongoDBHandler, get_mongo
 from models.local_embedder import LocalEmbedder
 from models.triton_embedder import TritonEmbedder
 
-def run_search(query_text: str, query_image_url: str, embedder_type: str):
-    # Load Annoy index metadata
-    with open(config.ID_MAP_PATH, "r", encoding="utf-8") as f:
-      data = json.load(f)
-      id_map = {int(k): v for k, v in data["id_map"].items()}
-      dim = data["dim"]
+# Product fields returned by /search
+PRODUCT_PROJECTION = {"_id": 0, "id": 1, "name": 1, "category": 1, "price": 1, "image_url": 1}
 
-    index = AnnoyIndex(dim, "angular")
-    index.load(config.INDEX_PATH)
 
-    # ---- Init MongoDB ----
-    mongo = MongoDBHandler()
+def load_product_meta(mongo: MongoDBHandler) -> Dict[str, Dict]:
+    """
+    Load the search-facing metadata of every product into memory, keyed by product ID.
+    The catalog is small, so this keeps MongoDB off the per-query path.
+    """
+    return {doc["id"]: doc for doc in mongo.products.find({}, PRODUCT_PROJECTION)}
+
+
+@lru_cache(maxsize=None)
+def get_embedder(embedder_type: str):
+    """
+    Return the process-wide embedder for `embedder_type` ("local" or "triton").
+    Models/tokenizers are loaded on first use and stay resident afterwards.
+    """
+    if embedder_type == "local":
+        return LocalEmbedder()
+    if embedder_type == "triton":
+        return TritonEmbedder(url=config.TRITON_URL, model_name="aligned")
+    raise ValueError("embedder_type must be 'local' or 'triton'")
+
+
+@lru_cache(maxsize=1)
+def _load_index(index_path: str, id_map_path: str, mtime: tuple):
+    """
+    Load the Annoy index + id_map once per index build (`mtime` is the cache key).
+    prefault=True pulls the whole mmap into RAM once, so searches don't page-fault.
+    """
+    return load_index(index_path, id_map_path, prefault=True)
+
+
+def get_index():
+    """
+    Return the cached (index, dim, id_map). A rebuilt index has a new mtime,
+    so it is picked up on the next call without restarting the server.
+    """
+    mtime = (os.path.getmtime(config.INDEX_PATH), os.path.getmtime(config.ID_MAP_PATH))
+    return _load_index(config.INDEX_PATH, config.ID_MAP_PATH, mtime)
+
+
+def run_search(query_text: str, query_image_url: str, embedder_type: str,
+               product_meta: Optional[Dict[str, Dict]] = None):
+    # Persisted Annoy index (mmap) and its metadata, loaded once per build
+    index, dim, id_map = get_index()
 
     # ---- Choose embedder ----
     if not query_text and not query_image_url:
-        print("❌ You must provide at least --query_text or --image_url")
-        sys.exit(1)
+        raise ValueError("❌ You must provide at least query_text or query_image_url")
+
+    embedder = get_embedder(embedder_type)
 
     if embedder_type == "local":
         print("⚡ Using Local Embedder")
-        embedder = LocalEmbedder()
         query_combined = embedder.embed(
             texts=[query_text] if query_text else None,
             images=[query_image_url] if query_image_url else None
         )
 
-    elif embedder_type == "triton":
-        print("⚡ Using Triton Embedder (remote inference)")
-        triton = TritonEmbedder(url=config.TRITON_URL, model_name="aligned")
-        query_combined = triton.embed(query_text, query_image_url)
-
     else:
-        raise ValueError("embedder_type must be 'local' or 'triton'")
+        print("⚡ Using Triton Embedder (remote inference)")
+        query_combined = embedder.embed(query_text, query_image_url)
 
     # ---- Search ----
     top_k = 1 # Only find the best match
+    query_combined = np.ascontiguousarray(query_combined, dtype=np.float32)
     nn_indices, distances = index.get_nns_by_vector(
-        query_combined[0].tolist(), top_k, include_distances=True
+        query_combined[0], top_k, include_distances=True
     )
     pids = [str(id_map[idx]) for idx in nn_indices]
 
-    docs = list(mongo.products.find(
-        {"id": {"$in": pids}},
-        {"_id": 0, "id": 1, "name": 1, "category": 1, "price": 1, "image_url": 1}
-    ))
-    doc_map = {doc["id"]: doc for doc in docs}
-
-    print("🔍 Query results:")
-    results = []
-    for idx, dist in zip(nn_indices, distances):
-        pid = str(id_map[idx])
-        doc = doc_map.get(pid)
-        if doc:
-          result = {
-              "id": doc["id"],
-              "name": doc.get("name"),
-              "category": doc.get("category"),
-              "price": doc.get("price"),
-              "image_url": doc.get("image_url"),
-              "distance": round(dist, 4)
-          }
-          print(
-              f" - ID: {result['id']}, "
-              f"Name: {result['name']}, "
-              f"Category: {result['category']}, "
-              f"Price: {result['price']}, "
-              f"Image: {result['image_url']}, "
-              f"Distance={result['distance']}"
-          )
-          results.append(result)
+    # Product metadata: in-memory map if preloaded, otherwise one MongoDB lookup
+    # on the unique `id` index (find_one skips cursor setup for the top-1 case)
+    if product_meta is not None:
+        doc_map = product_meta
+    elif len(pids) == 1:
+        doc = get_mongo().products.find_one({"id": pids[0]}, PRODUCT_PROJECTION)
+        doc_map = {doc["id"]: doc} if doc else {}
+    else:
+        docs = get_mongo().products.find({"id": {"$in": pids}}, PRODUCT_PROJECTION).hint("id_1")
+        doc_map = {doc["id"]: doc for doc in docs}
+
+    # Build the response in ANN order straight from the metadata map
+    hits = [(doc_map.get(pid), dist) for pid, dist in zip(pids, distances)]
+    results = [
+        {
+            "id": doc["id"],
+            "name": doc.get("name"),
+            "category": doc.get("category"),
+            "price": doc.get("price"),
+            "image_url": doc.get("image_url"),
+            "distance": round(dist, 4)
+        }
+        for doc, dist in hits if doc
+    ]
+    print(f"🔍 Query results: {results}")
 
     return {"results": results}
@@ -0,0 +1,59 @@
+import threading
+
+import pytest
+
+from utils.batching import DynamicBatcher
+
+# Generous so slow CI never flushes a batch before all items are queued
+_LONG_TIMEOUT_MS = 1000
+
+
+def _recording_batcher(max_batch_size, timeout_ms, fail_on=None):
+    calls = []
+    lock = threading.Lock()
+
+    def batch_fn(items):
+        with lock:
+            calls.append(list(items))
+        if fail_on in items:
+            raise ValueError(f"bad item {fail_on!r}")
+        return [item * 2 for item in items]
+
+    return DynamicBatcher(batch_fn, max_batch_size=max_batch_size, timeout_ms=timeout_ms), calls
+
+
+def test_coalesces_up_to_max_batch_size():
+    batcher, calls = _recording_batcher(max_batch_size=3, timeout_ms=_LONG_TIMEOUT_MS)
+    futures = [batcher.submit(i) for i in range(7)]
+
+    assert [f.result(timeout=5) for f in futures] == [i * 2 for i in range(7)]
+    assert calls == [[0, 1, 2], [3, 4, 5], [6]]
+
+
+def test_flushes_partial_batch_after_timeout():
+    batcher, calls = _recording_batcher(max_batch_size=32, timeout_ms=20)
+    futures = [batcher.submit(i) for i in range(2)]
+
+    assert [f.result(timeout=5) for f in futures] == [0, 2]
+    assert calls == [[0, 1]]
+
+
+def test_failing_item_only_fails_its_own_caller():
+    batcher, calls = _recording_batcher(max_batch_size=3, timeout_ms=_LONG_TIMEOUT_MS, fail_on=1)
+    futures = [batcher.submit(i) for i in range(3)]
+
+    assert futures[0].result(timeout=5) == 0
+    with pytest.raises(ValueError, match="bad item 1"):
+        futures[1].result(timeout=5)
+    assert futures[2].result(timeout=5) == 4
+    # One batched attempt, then one retry per item
+    assert calls == [[0, 1, 2], [0], [1], [2]]
+
+
+def test_output_length_mismatch_fails_every_caller():
+    batcher = DynamicBatcher(lambda items: items[:-1], max_batch_size=2, timeout_ms=_LONG_TIMEOUT_MS)
+    futures = [batcher.submit(i) for i in range(2)]
+
+    for f in futures:
+        with pytest.raises(ValueError, match="outputs for"):
+            f.result(timeout=5)
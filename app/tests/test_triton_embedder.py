@@ -0,0 +1,36 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("torch")
+pytest.importorskip("transformers")
+pytest.importorskip("tritonclient.http")
+
+from models import triton_embedder
+from models.triton_embedder import TritonEmbedder
+
+
+def test_embed_batch_splits_requests_at_max_batch_size(monkeypatch):
+    # Skip __init__: no tokenizer/processor downloads or Triton connection needed
+    embedder = TritonEmbedder.__new__(TritonEmbedder)
+    chunk_sizes = []
+
+    def fake_embed_chunk(texts, image_paths_or_urls):
+        assert len(texts) == len(image_paths_or_urls)
+        chunk_sizes.append(len(texts))
+        return np.array([[float(t)] for t in texts], dtype=np.float32)
+
+    monkeypatch.setattr(embedder, "_embed_chunk", fake_embed_chunk)
+
+    n = 2 * triton_embedder._MAX_BATCH_SIZE + 6
+    texts = [str(i) for i in range(n)]
+    out = embedder.embed_batch(texts, [f"img_{i}.jpg" for i in range(n)])
+
+    assert chunk_sizes == [triton_embedder._MAX_BATCH_SIZE, triton_embedder._MAX_BATCH_SIZE, 6]
+    assert out.shape == (n, 1)
+    np.testing.assert_array_equal(out[:, 0], np.arange(n, dtype=np.float32))
+
+
+def test_embed_batch_rejects_mismatched_lengths():
+    embedder = TritonEmbedder.__new__(TritonEmbedder)
+    with pytest.raises(ValueError):
+        embedder.embed_batch(["a", "b"], ["img.jpg"])
@@ -0,0 +1,93 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, List, Sequence
+
+
+class DynamicBatcher:
+    """
+    Coalesce concurrent single-item calls into one batched call.
+
+    Callers submit one item at a time from any thread; a background worker
+    drains up to `max_batch_size` items (or whatever arrived within
+    `timeout_ms` of the first one), runs `batch_fn` once on the list and
+    scatters the per-item outputs back to the callers' futures. If the batched
+    call fails, items are re-run one at a time so an error only reaches the
+    caller whose item caused it.
+    """
+
+    def __init__(
+        self,
+        batch_fn: Callable[[List[Any]], Sequence[Any]],
+        max_batch_size: int = 32,
+        timeout_ms: float = 10,
+    ):
+        """
+        Args:
+            batch_fn (Callable): Function mapping a list of items to a sequence
+                                 of outputs of the same length (e.g. a [B, D] tensor).
+            max_batch_size (int): Upper bound on items per batched call.
+            timeout_ms (float): How long to wait for more items after the first.
+        """
+        self.batch_fn = batch_fn
+        self.max_batch_size = max_batch_size
+        self.timeout = timeout_ms / 1000
+        self._queue: "queue.Queue[tuple]" = queue.Queue()
+        self._worker = threading.Thread(target=self._run, daemon=True)
+        self._worker.start()
+
+    def submit(self, item: Any) -> Future:
+        """Queue one item and return a future resolving to its output."""
+        fut: Future = Future()
+        self._queue.put((item, fut))
+        return fut
+
+    def __call__(self, item: Any) -> Any:
+        """Blocking convenience wrapper around `submit`."""
+        return self.submit(item).result()
+
+    # -------------------------------
+    # Internals
+    # -------------------------------
+    def _next_batch(self) -> List[tuple]:
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.timeout
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self) -> None:
+        while True:
+            batch = self._next_batch()
+            try:
+                outputs = self._call([item for item, _ in batch])
+            except Exception as e:
+                if len(batch) == 1:
+                    batch[0][1].set_exception(e)
+                    continue
+                # One bad item (e.g. a 404 image URL) must not fail the requests
+                # it was coalesced with: retry one by one so each gets its own result
+                for item, fut in batch:
+                    try:
+                        fut.set_result(self._call([item])[0])
+                    except Exception as item_error:
+                        fut.set_exception(item_error)
+                continue
+            for (_, fut), out in zip(batch, outputs):
+                fut.set_result(out)
+
+    def _call(self, items: List[Any]) -> Sequence[Any]:
+        outputs = self.batch_fn(items)
+        # zip() would silently leave the extra callers' futures pending forever
+        if len(outputs) != len(items):
+            raise ValueError(
+                f"batch_fn returned {len(outputs)} outputs for {len(items)} items"
+            )
+        return outputs
@@ -0,0 +1,17 @@
+import threading
+from contextlib import nullcontext
+from typing import ContextManager
+
+# The MPS command stream is not thread-safe: every MPS op in the process goes
+# through this one lock (re-entrant so locked helpers can nest)
+_MPS_LOCK = threading.RLock()
+
+
+def device_lock(device: str) -> ContextManager:
+    """
+    Context manager guarding tensor work on `device` ("cpu", "cuda", "mps", "cuda:0", ...).
+    Serializes MPS work across threads; CPU/CUDA run concurrently (no-op).
+    """
+    if str(device).split(":")[0] == "mps":
+        return _MPS_LOCK
+    return nullcontext()
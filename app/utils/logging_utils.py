@@ -2,7 +2,7 @@ import asyncio
 import traceback
 import functools
 from starlette.datastructures import UploadFile
-from db.mongo_client import MongoDBHandler
+from db.mongo_client import get_mongo
 
 
 def sanitize_for_mongo(data):
@@ -34,7 +34,7 @@ def with_logging(event_name: str):
     def decorator(func):
         @functools.wraps(func)
         async def async_wrapper(*args, **kwargs):
-            db = MongoDBHandler()
+            db = get_mongo()
             try:
                 result = await func(*args, **kwargs)
                 db.log_event(event_name, {
@@ -49,7 +49,7 @@ def with_logging(event_name: str):
 
         @functools.wraps(func)
         def sync_wrapper(*args, **kwargs):
-            db = MongoDBHandler()
+            db = get_mongo()
             try:
                 result = func(*args, **kwargs)
                 db.log_event(event_name, {